@@ -10,7 +10,6 @@
 
 import os
 import sys
-import json
 import csv
 import argparse
 import tempfile
@@ -18,6 +17,8 @@ import subprocess
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
 
+from ..utils import json_io
+
 DEFAULT_MISSING = Path(os.getenv("MISSING_OBS_JSON", "data/metadonnees/missing_observations.json"))
 DEFAULT_STATIONS = Path(os.getenv("STATIONS_JSON", "data/metadonnees/stations.json"))
 DEFAULT_LOGDIR = Path(os.getenv("OBS_LOGDIR", "logs/observations"))
@@ -29,8 +30,7 @@ def _read_missing_grouped(path: Path) -> List[Dict[str, Any]]:
     if not path.exists():
         return []
     try:
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = json_io.loads(path.read_bytes())
     except Exception:
         return []
 
@@ -63,8 +63,8 @@ def _atomic_write_json_grouped(path: Path, grouped: List[Dict[str, Any]]) -> Non
     cleaned.sort(key=lambda x: x["id"])
 
     path.parent.mkdir(parents=True, exist_ok=True)
-    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", dir=str(path.parent)) as tmp:
-        json.dump(cleaned, tmp, ensure_ascii=False, indent=2)
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=str(path.parent)) as tmp:
+        tmp.write(json_io.dumps(cleaned, indent=True))
         tmp.flush()
         os.fsync(tmp.fileno())
         tmp_name = tmp.name
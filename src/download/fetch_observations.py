@@ -11,29 +11,36 @@
 #   - telecharger_commande() ne renvoie plus HTTP0 immédiatement: attend et réessaie.
 #   - Logs plus informatifs (pas, fenêtre, id commande).
 #   - Respect du rate limiting.
+#   - Stations traitées en parallèle (pool de threads borné, session HTTP partagée).
 #
-# Dépendances: requests, python-dateutil
+# Dépendances: requests, python-dateutil (optionnel: orjson)
 
-import os
 import io
+import os
 import sys
 import csv
-import json
 import time
+import atexit
 import argparse
+import tempfile
+import threading
 import datetime as dt
 from datetime import timezone
-from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from functools import lru_cache
 from typing import Dict, Tuple, List, Optional
 
 import requests
-from dateutil import tz, parser as dtparser
+from requests.adapters import HTTPAdapter
+from dateutil import parser as dtparser
 
 # --- Auth MF OAuth2 (portail) --------------------------------------------
 from src.api.token_provider import get_api_key, clear_token_cache  # type: ignore
 # --- Registre des données manquantes -------------------------------------
-from src.utils.missing_registry import append_missing  # type: ignore
+from src.utils.missing_registry import append_missing, compact as compact_missing  # type: ignore
+# --- JSON (orjson si disponible) ------------------------------------------
+from src.utils import json_io  # type: ignore
+from src.utils.rate_limiter import TokenBucket  # type: ignore
 
 
 # --- Configuration --------------------------------------------------------
@@ -48,6 +55,20 @@ PASSES = ["quotidienne", "horaire", "infrahoraire-6m"]
 # Limiteur de débit (RPM = requêtes par minute)
 MAX_RPM = int(os.getenv("METEO_MAX_RPM", "50"))
 RATE_SECS = 60.0
+# Rafale tolérée: au-delà, un appel toutes les RATE_SECS / MAX_RPM secondes
+RATE_BURST = int(os.getenv("METEO_BURST", "5"))
+
+# Stations traitées en parallèle (I/O réseau); le débit reste borné par MAX_RPM
+MAX_WORKERS = int(os.getenv("METEO_WORKERS", str(max(1, MAX_RPM // 2))))
+# Requêtes HTTP simultanées (tous threads confondus), sous la taille du pool de connexions
+MAX_INFLIGHT = int(os.getenv("METEO_MAX_INFLIGHT", "16"))
+
+# Taille des paquets de lignes CSV écrits sur stdout
+OUT_FLUSH_ROWS = 256
+
+# Cache disque des réponses /information-station (métadonnées quasi statiques)
+INFO_CACHE_DIR = os.getenv("METEO_INFO_CACHE_DIR", ".cache/info_station")
+INFO_CACHE_TTL = float(os.getenv("METEO_INFO_CACHE_TTL", str(7 * 24 * 3600)))
 
 STRICT_SCALES = os.getenv("DPCLIM_STRICT_SCALES", "true").lower() in ("1", "true", "yes")
 
@@ -57,6 +78,8 @@ _PAS_KEYWORDS = {
     "horaire": ["horaire"],
     "infrahoraire-6m": ["6 mn", "6min", "6 min", "6 minutes"],
 }
+# Figés et en minuscules une fois pour toutes
+_PAS_KEYWORDS = {pas: tuple(k.lower() for k in kws) for pas, kws in _PAS_KEYWORDS.items()}
 
 # Colonnes à conserver par pas
 COL_KEEP = {
@@ -64,6 +87,13 @@ COL_KEEP = {
     "horaire": ["HNEIGEF", "NEIGETOT"],
     "infrahoraire-6m": [],
 }
+# Alias MF gardés pour l'harmonisation (NEIGETOTX -> NEIGETOT en quotidienne)
+_COL_ALIASES = {"quotidienne": ["NEIGETOTX"]}
+# Colonnes gardées par pas, en majuscules, figées une fois pour toutes
+COL_KEEP_UPPER = {
+    pas: frozenset(c.upper() for c in cols + _COL_ALIASES.get(pas, []))
+    for pas, cols in COL_KEEP.items()
+}
 
 # Union dédupliquée des colonnes à exporter
 def _build_union_cols() -> List[str]:
@@ -78,40 +108,28 @@ def _build_union_cols() -> List[str]:
 
 
 UNION_COLS = _build_union_cols()  # ex: ["HNEIGEF","NEIGETOT","NEIGETOT06"]
+UNION_COLS_LOWER = [c.lower() for c in UNION_COLS]
 
-# --- Rate limiter ---------------------------------------------------------
-class RateLimiter:
-    """Glisse une fenêtre de RATE_SECS secondes et borne à MAX_RPM appels."""
-
-    def __init__(self, max_calls: int, period_sec: float):
-        self.max_calls = max_calls
-        self.period = period_sec
-        self.calls = deque()
+# Pas qui apportent au moins une colonne: les autres ne sont jamais commandés
+_USEFUL_PASSES = [p for p in PASSES if COL_KEEP.get(p)]
 
-    def wait(self) -> None:
-        now = time.time()
-        # évacue les appels en dehors de la fenêtre
-        while self.calls and (now - self.calls[0]) > self.period:
-            self.calls.popleft()
-        # si plein: dort juste ce qu'il faut
-        if len(self.calls) >= self.max_calls:
-            sleep_for = self.period - (now - self.calls[0]) + 0.01
-            if sleep_for > 0:
-                time.sleep(sleep_for)
-        self.calls.append(time.time())
+# --- Rate limiter ---------------------------------------------------------
+_rl = TokenBucket(MAX_RPM / RATE_SECS, RATE_BURST)
 
+# --- Logging fichier ------------------------------------------------------
+_LOG_FH = None
+_LOG_LOCK = threading.Lock()
 
-_rl = RateLimiter(MAX_RPM, RATE_SECS)
 
-# --- Logging fichier ------------------------------------------------------
-def _init_log_file(logdir: str) -> str:
+def _init_log_file(logdir: str) -> None:
     # UTC pour éviter l'ambiguïté; format AAAAMMJJHHMMSS
+    global _LOG_FH
     ts = dt.datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
     os.makedirs(logdir, exist_ok=True)
-    return os.path.join(logdir, f"{ts}.log")
-
-
-_LOG_PATH: Optional[str] = None
+    path = os.path.join(logdir, f"{ts}.log")
+    # handle unique et bufferisé pour tout le run, vidé à la sortie
+    _LOG_FH = open(path, "a", encoding="utf-8", buffering=1 << 14)
+    atexit.register(_LOG_FH.close)
 
 
 def _log_line(station_id: int, etat: str, ok_data: bool, reason: str = "") -> None:
@@ -119,20 +137,53 @@ def _log_line(station_id: int, etat: str, ok_data: bool, reason: str = "") -> No
     Ecrit une ligne de log normalisée:
     [id] : Etat de la connection | Données récupérées ou non | Si non la raison
     """
-    global _LOG_PATH
-    if not _LOG_PATH:
+    if _LOG_FH is None:
         return
     data_str = "Oui" if ok_data else "Non"
     reason_str = reason.strip() if (reason and not ok_data) else ""
     line = f"[{station_id}] : {etat} | Données récupérées : {data_str} | {reason_str}".rstrip()
-    with open(_LOG_PATH, "a", encoding="utf-8") as fh:
-        fh.write(line + "\n")
+    with _LOG_LOCK:
+        _LOG_FH.write(line + "\n")
 
 
 # --- HTTP helpers ---------------------------------------------------------
+# Session unique: keep-alive, réutilise la connexion TLS entre les appels
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=0))
+_INFLIGHT = threading.BoundedSemaphore(max(1, MAX_INFLIGHT))
+# Compression: gzip/deflate, plus br si le paquet brotli est installé (décodage transparent)
+_SESSION.headers.update({
+    "accept": "application/json",
+    "accept-encoding": requests.utils.DEFAULT_ACCEPT_ENCODING,
+    "User-Agent": "niveo/0.1.0",
+})
+
+
+# En-tête Bearer mémorisé: get_api_key() (lecture du cache fichier) au plus toutes les 5 min
+_AUTH_HEADER: Optional[str] = None
+_AUTH_FETCHED_AT: float = 0.0
+_AUTH_TTL = 300.0
+_AUTH_LOCK = threading.Lock()
+
+
+def _get_auth_header() -> str:
+    global _AUTH_HEADER, _AUTH_FETCHED_AT
+    with _AUTH_LOCK:
+        if _AUTH_HEADER is None or (time.time() - _AUTH_FETCHED_AT) >= _AUTH_TTL:
+            _AUTH_HEADER = f"Bearer {get_api_key(use_cache=True)}"
+            _AUTH_FETCHED_AT = time.time()
+        return _AUTH_HEADER
+
+
+def _reset_auth_header() -> None:
+    global _AUTH_HEADER
+    with _AUTH_LOCK:
+        _AUTH_HEADER = None
+
+
 def _headers_json() -> Dict[str, str]:
-    token = get_api_key(use_cache=True)
-    return {"accept": "application/json", "authorization": f"Bearer {token}"}
+    # accept est porté par la session, seul le Bearer varie
+    return {"authorization": _get_auth_header()}
 
 
 def _req(method: str, url: str, *, params=None, timeout=60):
@@ -150,9 +201,10 @@ def _req(method: str, url: str, *, params=None, timeout=60):
     for attempt in (1, 2):
         try:
             _rl.wait()
-            resp = requests.request(
-                method, url, headers=_headers_json(), params=params, timeout=timeout
-            )
+            with _INFLIGHT:
+                resp = _SESSION.request(
+                    method, url, headers=_headers_json(), params=params, timeout=timeout
+                )
             last_resp = resp
         except requests.RequestException:
             if attempt == 1:
@@ -161,6 +213,7 @@ def _req(method: str, url: str, *, params=None, timeout=60):
             return None
 
         if resp.status_code in (401, 403) and attempt == 1:
+            _reset_auth_header()
             clear_token_cache()
             time.sleep(0.5)
             continue
@@ -184,9 +237,13 @@ def _floor_to_6min(d: dt.datetime) -> dt.datetime:
     return d.replace(minute=m, second=0, microsecond=0)
 
 
+@lru_cache(maxsize=16)
 def _day_window_utc(day_str: str, pas: str) -> Tuple[str, str]:
-    """Fenêtre UTC pour la journée cible. 6 min: borne sup à 23:54:00Z, bornée à 'now' si jour courant."""
-    d = dt.datetime.strptime(day_str, "%Y-%m-%d").replace(tzinfo=tz.UTC)
+    """
+    Fenêtre UTC pour la journée cible. 6 min: borne sup à 23:54:00Z, bornée à 'now' si jour courant.
+    Mémoïsée: une seule date par run, la borne 'now' est figée au premier appel.
+    """
+    d = dt.datetime.strptime(day_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
     if pas != "infrahoraire-6m":
         start = d.replace(hour=0, minute=0, second=0, microsecond=0)
         end = d.replace(hour=23, minute=59, second=59, microsecond=0)
@@ -194,7 +251,7 @@ def _day_window_utc(day_str: str, pas: str) -> Tuple[str, str]:
 
     day_start = d.replace(hour=0, minute=0, second=0, microsecond=0)
     day_end_6 = d.replace(hour=23, minute=54, second=0, microsecond=0)
-    now_utc = dt.datetime.now(tz.UTC)
+    now_utc = dt.datetime.now(timezone.utc)
     if d.date() == now_utc.date():
         now_floor = _floor_to_6min(now_utc)
         end_6 = min(day_end_6, now_floor)
@@ -203,19 +260,38 @@ def _day_window_utc(day_str: str, pas: str) -> Tuple[str, str]:
     return day_start.strftime("%Y-%m-%dT%H:%M:%SZ"), end_6.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+# Formats compacts DPClim par largeur: AAAAMMJJ, AAAAMMJJHH, AAAAMMJJHHMM
+_COMPACT_FMTS = {8: "%Y%m%d", 10: "%Y%m%d%H", 12: "%Y%m%d%H%M", 14: "%Y%m%d%H%M%S"}
+
+
+def _fast_parse(s: str) -> dt.datetime:
+    """
+    Format compact (strptime) si numérique, sinon fromisoformat (accepte 'Z' en 3.11+).
+    Repli dateutil pour les formats exotiques.
+    """
+    fmt = _COMPACT_FMTS.get(len(s)) if s.isdigit() else None
+    try:
+        if fmt:
+            return dt.datetime.strptime(s, fmt)
+        return dt.datetime.fromisoformat(s)
+    except ValueError:
+        return dtparser.parse(s)
+
+
 def _parse_any_to_utc(s: str) -> Optional[dt.datetime]:
     """Accepte ISO-8601 ou 'YYYY-MM-DD HH:MM:SS'. Retourne un datetime UTC."""
     if not s:
         return None
     try:
-        d = dtparser.parse(s)
-        return d.astimezone(tz.UTC) if d.tzinfo else d.replace(tzinfo=tz.UTC)
+        d = _fast_parse(s)
+        return d.astimezone(timezone.utc) if d.tzinfo else d.replace(tzinfo=timezone.utc)
     except Exception:
         return None
 
 
+@lru_cache(maxsize=16)
 def _day_bounds_utc(day_str: str) -> Tuple[dt.datetime, dt.datetime]:
-    d = dt.datetime.strptime(day_str, "%Y-%m-%d").replace(tzinfo=tz.UTC)
+    d = dt.datetime.strptime(day_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
     return (
         d.replace(hour=0, minute=0, second=0, microsecond=0),
         d.replace(hour=23, minute=59, second=59, microsecond=0),
@@ -223,44 +299,113 @@ def _day_bounds_utc(day_str: str) -> Tuple[dt.datetime, dt.datetime]:
 
 
 # --- API info-station -----------------------------------------------------
+def _info_cache_path(station_id: int) -> str:
+    return os.path.join(INFO_CACHE_DIR, f"info_{int(station_id)}.json")
+
+
+def _info_cache_read(station_id: int) -> Optional[dict]:
+    """Retourne l'info en cache disque si plus récente que INFO_CACHE_TTL, sinon None."""
+    path = _info_cache_path(station_id)
+    try:
+        if (time.time() - os.path.getmtime(path)) >= INFO_CACHE_TTL:
+            return None
+        with open(path, "rb") as fh:
+            data = json_io.loads(fh.read())
+        return data if isinstance(data, dict) and data else None
+    except Exception:
+        return None
+
+
+def _info_cache_write(station_id: int, info: dict) -> None:
+    """Écriture atomique; un échec de cache ne doit jamais bloquer le run."""
+    try:
+        os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", delete=False, dir=INFO_CACHE_DIR) as tmp:
+            tmp.write(json_io.dumps(info))
+            tmp_name = tmp.name
+        os.replace(tmp_name, _info_cache_path(station_id))
+    except Exception:
+        pass
+
+
+# Stations dont l'info provient du cache disque pendant ce run
+_INFO_FROM_DISK: set = set()
+
+
 @lru_cache(maxsize=4096)
-def _info_station_cached(station_id: int) -> dict:
+def _info_station_cached(station_id: int, refresh: bool = False) -> dict:
+    """Info station: cache disque sauf si refresh=True (force l'API et réécrit le cache)."""
+    if not refresh:
+        cached = _info_cache_read(station_id)
+        if cached is not None:
+            _INFO_FROM_DISK.add(station_id)
+            return cached
     url = f"{BASE_URL}/information-station"
     resp = _req("GET", url, params={"id-station": station_id}, timeout=30)
     if not resp or resp.status_code >= 400:
         return {}
     try:
-        js = resp.json()
-        return js[0] if isinstance(js, list) and js else js
+        js = json_io.loads(resp.content)
+        info = js[0] if isinstance(js, list) and js else js
     except Exception:
         return {}
+    # seules les réponses exploitables sont persistées
+    if isinstance(info, dict) and info:
+        _info_cache_write(station_id, info)
+    return info
 
 
-def _pas_active_this_day(info: dict, pas: str, day_str: str) -> bool:
-    """Vérifie si un paramètre correspondant au 'pas' est actif le jour 'day_str'."""
+@lru_cache(maxsize=1024)
+def _pas_for_nom(nom: str) -> Tuple[str, ...]:
+    """Pas correspondant au nom d'un paramètre; mémoïsé (les libellés se répètent d'une station à l'autre)."""
+    low = nom.lower()
+    return tuple(pas for pas, keys in _PAS_KEYWORDS.items() if any(k in low for k in keys))
+
+
+def _index_parametres(info: dict) -> Dict[str, List[Tuple[dt.datetime, dt.datetime]]]:
+    """
+    Indexe info["parametres"] par pas: {pas: [(dateDebut, dateFin), ...]} en UTC.
+    Mots-clés et dates traités une seule fois par station (dateFin absente = ouvert).
+    """
+    index: Dict[str, List[Tuple[dt.datetime, dt.datetime]]] = {pas: [] for pas in _PAS_KEYWORDS}
     params = info.get("parametres") or []
     if not isinstance(params, list):
-        return False
-    start_day, end_day = _day_bounds_utc(day_str)
-    keys = _PAS_KEYWORDS[pas]
-    matched_any = False
+        return index
     for p in params:
-        nom_raw = str(p.get("nom", ""))
-        nom = nom_raw.lower()
-        if not any(k in nom for k in keys):
+        matched = _pas_for_nom(str(p.get("nom", "")))
+        if not matched:
             continue
-        matched_any = True
         d0 = _parse_any_to_utc(p.get("dateDebut", ""))
-        d1 = _parse_any_to_utc(p.get("dateFin", "")) or dt.datetime.max.replace(tzinfo=tz.UTC)
         if d0 is None:
             continue
-        if not (end_day < d0 or start_day > d1):
-            return True
-    if matched_any:
-        # station id n’est pas dans info → passer via log appelant
-        pass
-    return False
+        d1 = _parse_any_to_utc(p.get("dateFin", "")) or dt.datetime.max.replace(tzinfo=timezone.utc)
+        for pas in matched:
+            index[pas].append((d0, d1))
+    return index
+
+
+@lru_cache(maxsize=4096)
+def _station_activity(station_id: int, refresh: bool = False) -> Dict[str, List[Tuple[dt.datetime, dt.datetime]]]:
+    """Index des périodes d'activité par pas; {} si /information-station est indisponible."""
+    info = _info_station_cached(station_id, refresh)
+    return _index_parametres(info) if isinstance(info, dict) and info else {}
+
+
+def _station_activity_checked(station_id: int, scales: List[str]) -> Dict[str, List[Tuple[dt.datetime, dt.datetime]]]:
+    """
+    _station_activity, avec invalidation du cache disque: si l'info en cache ne connaît
+    pas un pas annoncé par _scales, elle est jugée périmée et redemandée une fois à l'API.
+    """
+    activity = _station_activity(station_id)
+    if activity and station_id in _INFO_FROM_DISK and any(not activity.get(p) for p in scales):
+        return _station_activity(station_id, refresh=True)
+    return activity
+
 
+def _pas_active_this_day(activity: Dict[str, List[Tuple[dt.datetime, dt.datetime]]], pas: str, day_str: str) -> bool:
+    """Vérifie si un paramètre correspondant au 'pas' est actif le jour 'day_str'."""
+    start_day, end_day = _day_bounds_utc(day_str)
+    return any(not (end_day < d0 or start_day > d1) for d0, d1 in activity.get(pas, ()))
 
 
 # --- API commande + téléchargement ---------------------------------------
@@ -276,38 +421,53 @@ def commande_station(station_id: int, pas: str, start_utc: str, end_utc: str) ->
     if resp.status_code not in (200, 201, 202):
         return False, "", f"HTTP{resp.status_code}"
     try:
-        cmd_id = resp.json()["elaboreProduitAvecDemandeResponse"]["return"]
+        cmd_id = json_io.loads(resp.content)["elaboreProduitAvecDemandeResponse"]["return"]
         return True, cmd_id, f"HTTP{resp.status_code}"
     except Exception:
         return False, "", f"HTTP{resp.status_code} parse_error"
 
 
-def telecharger_commande(commande_id: str, max_wait_s=300, step_s=5) -> Tuple[int, bytes]:
+def telecharger_commande(commande_id: str, max_wait_s=300, step_s=1.0,
+                         max_step_s=10.0, backoff=2.0,
+                         cancel: Optional[threading.Event] = None) -> Tuple[int, bytes]:
     """
-    Polling de /commande/fichier.
-    - 204 => attendre (Retry-After si fourni).
-    - None => échec transitoire: attendre et réessayer.
+    Polling de /commande/fichier avec attente exponentielle (1, 2, 4, 8, 10, 10... s).
+    max_wait_s borne le temps réel écoulé depuis le premier poll (attentes du
+    rate limiter et durée des requêtes comprises).
+    - 204 => attendre (Retry-After si fourni, sinon pas courant).
+    - None => échec transitoire: attendre et réessayer (plafond 30 s).
     - 200/201 => OK avec contenu.
     - 4xx/5xx => échec définitif pour cette commande.
+    - cancel positionné => abandon (0, b"").
     """
+    def _sleep(secs: float) -> None:
+        if cancel is not None:
+            cancel.wait(secs)
+        else:
+            time.sleep(secs)
+
     url = f"{BASE_URL}/commande/fichier"
-    waited = 0.0
-    while waited <= max_wait_s:
+    first_seen = time.monotonic()
+    step = float(step_s)
+    err_step = float(step_s)
+    while (time.monotonic() - first_seen) <= max_wait_s:
+        if cancel is not None and cancel.is_set():
+            return 0, b""
         resp = _req("GET", url, params={"id-cmde": commande_id}, timeout=60)
         if resp and resp.status_code in (200, 201):
             return resp.status_code, resp.content
         if resp and resp.status_code == 204:
             ra = resp.headers.get("Retry-After")
             try:
-                step = float(ra) if ra is not None else float(step_s)
+                wait = float(ra) if ra is not None else step
             except ValueError:
-                step = float(step_s)
-            time.sleep(step)
-            waited += step
+                wait = step
+            _sleep(wait)
+            step = min(step * backoff, max_step_s)
             continue
         if resp is None:
-            time.sleep(step_s)
-            waited += step_s
+            _sleep(err_step)
+            err_step = min(err_step * 2, 30.0)
             continue
         # autre code HTTP (4xx/5xx) -> stop propre
         return resp.status_code, b""
@@ -315,59 +475,290 @@ def telecharger_commande(commande_id: str, max_wait_s=300, step_s=5) -> Tuple[in
 
 
 # --- Parsing CSV ----------------------------------------------------------
+_DATE_KEYS = ("date", "datetime", "time", "heure")
+
+
+def _date_col_index(cols: List[str]) -> Optional[int]:
+    """Index de la colonne temporelle (date/datetime/time/heure), insensible à la casse."""
+    lower = [(c or "").lower() for c in cols]
+    for k in _DATE_KEYS:
+        if k in lower:
+            return lower.index(k)
+    return None
+
+
+def _row_dict(cols: List[str], values: List[str]) -> dict:
+    """Associe header/valeurs (trim), champs absents à None comme DictReader."""
+    return {
+        k: (values[i].strip() if i < len(values) else None)
+        for i, k in enumerate(cols)
+    }
+
+
+_TAIL_LINES = 4  # lignes de fin essayées avant le scan complet
+
+
 def parse_latest_row(csv_bytes: bytes):
     """
     Cherche colonne temporelle (date/datetime/time/heure) et prend la dernière.
+    Les lignes sont chronologiques: seules les dernières lignes sont parsées; scan en flux
+    (max des dates) uniquement si aucune n'a de date lisible.
     Retourne (dt_utc, row_dict, colonnes_header)
     """
-    if not csv_bytes:
+    body = csv_bytes.strip() if csv_bytes else b""
+    if not body:
         return None, None, []
-    text = csv_bytes.decode("utf-8", errors="ignore")
-    reader = csv.DictReader(io.StringIO(text), delimiter=";")
-    cols = reader.fieldnames or []
+    # Découpe au niveau octets: seuls header et dernière ligne sont décodés
+    first_nl = body.find(b"\n")
+    header = body if first_nl < 0 else body[:first_nl]
+    cols = next(csv.reader([header.decode("utf-8", errors="ignore").strip()], delimiter=";"), [])
+    didx = _date_col_index(cols)
+    if didx is None or first_nl < 0:
+        return None, None, cols
+
+    # Chemin rapide: dernières lignes, remontées via rfind (pied de fichier/lignes vides tolérés)
+    end = len(body)
+    for _ in range(_TAIL_LINES):
+        if end <= first_nl:
+            break
+        start = body.rfind(b"\n", first_nl, end) + 1
+        line = body[start:end].decode("utf-8", errors="ignore").strip()
+        end = start - 1
+        if not line:
+            continue
+        values = next(csv.reader([line], delimiter=";"), [])
+        cur = _parse_any_to_utc(values[didx].strip()) if didx < len(values) else None
+        if cur is not None:
+            return cur, _row_dict(cols, values), cols
+
+    # Repli: scan en flux. Dates de largeur constante (AAAAMMJJ[HH[MM]], ISO) -> max lexical,
+    # seul le gagnant est parsé; sinon parse ligne à ligne.
+    text = body[first_nl + 1:].decode("utf-8", errors="ignore")
+    best_key = None
+    best_values = None
+    width = None
+    for values in csv.reader(io.StringIO(text), delimiter=";"):
+        if didx >= len(values):
+            continue
+        key = values[didx].strip()
+        if not key:
+            continue
+        if width is None:
+            width = len(key)
+        elif len(key) != width:
+            best_values = None
+            break
+        if best_key is None or key > best_key:
+            best_key, best_values = key, values
+    if best_values is not None:
+        best_dt = _parse_any_to_utc(best_key)
+        if best_dt is not None:
+            return best_dt, _row_dict(cols, best_values), cols
+
     best_dt = None
     best_row = None
-    for row in reader:
-        # trim
-        for k, v in list(row.items()):
-            if isinstance(v, str):
-                row[k] = v.strip()
-        keys = {k.lower(): k for k in row.keys()}
-        dkey = next((keys[k] for k in ("date", "datetime", "time", "heure") if k in keys), None)
-        if not dkey:
+    for values in csv.reader(io.StringIO(text), delimiter=";"):
+        if didx >= len(values):
             continue
-        try:
-            cur = dtparser.parse(row[dkey])
-            cur = cur.astimezone(tz.UTC) if cur.tzinfo else cur.replace(tzinfo=tz.UTC)
-        except Exception:
+        cur = _parse_any_to_utc(values[didx].strip())
+        if cur is None:
             continue
         if (best_dt is None) or (cur > best_dt):
             best_dt = cur
-            best_row = row
+            best_row = _row_dict(cols, values)
     return best_dt, best_row, cols
 
 
 # --- Sélection pas --------------------------------------------------------
 def _scales_for_station(st: dict) -> List[str]:
-    """Retourne les pas autorisés pour la station, en respectant l'ordre global PASSES."""
+    """
+    Retourne les pas autorisés pour la station, en respectant l'ordre global PASSES.
+    Limité aux pas utiles (COL_KEEP non vide).
+    """
     avail = st.get("_scales") or []
     if not isinstance(avail, list):
         avail = []
-    ordered = [p for p in PASSES if p in avail]
-    return ordered if ordered or STRICT_SCALES else PASSES
+    ordered = [p for p in _USEFUL_PASSES if p in avail]
+    return ordered if ordered or STRICT_SCALES else list(_USEFUL_PASSES)
 
 
 # --- Utilitaires valeurs --------------------------------------------------
 def _pick_values_case_insensitive(row: dict, wanted: List[str]) -> Dict[str, str]:
     """Retourne un dict {COL: valeur_str} respectant la casse de wanted, recherche insensible."""
-    lowmap = {k.lower(): k for k in row.keys()}
+    wanted_lower = UNION_COLS_LOWER if wanted is UNION_COLS else [c.lower() for c in wanted]
+    lowmap = None
     out = {}
-    for col in wanted:
-        key = lowmap.get(col.lower())
+    for col, low in zip(wanted, wanted_lower):
+        # casse exacte (cas courant: colonnes MF en majuscules)
+        if col in row:
+            out[col] = row[col]
+            continue
+        if lowmap is None:
+            lowmap = {k.lower(): k for k in row.keys() if k}
+        key = lowmap.get(low)
         out[col] = row.get(key, "") if key else ""
     return out
 
 
+# --- Traitement d'une station --------------------------------------------
+# Une mesure à partir de cette heure (UTC) clôt la journée: les autres pas sont abandonnés
+_LATE_HOUR = 23
+
+
+def _try_pas(sid: int, pas: str, day_str: str,
+             done: Optional[threading.Event] = None) -> Optional[Tuple[dt.datetime, dict, str, str]]:
+    """
+    Commande + polling + parsing pour un pas déjà jugé actif le jour cible. Les pas
+    d'une station sont indépendants côté API et tournent en parallèle.
+    'done' est positionné dès qu'un pas obtient une mesure de fin de journée; les autres
+    pas de la station s'arrêtent alors sans commander ni poller davantage.
+    Retourne (last_dt, row, pas, cmd_id) si une mesure du jour cible est trouvée, sinon None.
+    """
+    if done is not None and done.is_set():
+        _log_line(sid, f"{pas}:ignoré", False, "mesure de fin de journée déjà obtenue")
+        return None
+
+    # Fenêtre temporelle demandée
+    s_utc, e_utc = _day_window_utc(day_str, pas)
+
+    # Création de commande
+    ok, cmd_id, etat = commande_station(sid, pas, s_utc, e_utc)
+    if not ok:
+        _log_line(sid, f"{etat}", False, f"commande pas={pas} {s_utc}→{e_utc} échouée")
+        return None
+
+    # Téléchargement avec polling
+    sc, content = telecharger_commande(cmd_id, max_wait_s=300, cancel=done)
+    if done is not None and done.is_set() and sc not in (200, 201):
+        _log_line(sid, f"{pas}:ignoré", False, f"cmd={cmd_id} mesure de fin de journée déjà obtenue")
+        return None
+    if sc not in (200, 201):
+        _log_line(sid, f"HTTP{sc}", False, f"pas={pas} cmd={cmd_id} fichier non prêt/erreur")
+        return None
+
+    # Parse et sélection de la dernière ligne datée
+    last_dt, row, _cols = parse_latest_row(content)
+    if not last_dt or not row:
+        _log_line(sid, "OK", False, f"pas={pas} cmd={cmd_id} aucune ligne datée valide")
+        return None
+
+    if last_dt.strftime("%Y-%m-%d") != day_str:
+        _log_line(sid, "OK", False, f"pas={pas} cmd={cmd_id} dernière mesure hors jour cible")
+        return None
+
+    if done is not None and last_dt.hour >= _LATE_HOUR:
+        done.set()
+    # Ne garde que les colonnes utiles au pas (et ses alias)
+    want = COL_KEEP_UPPER[pas]
+    row = {k: v for k, v in row.items() if k and k.upper() in want}
+    return last_dt, row, pas, cmd_id
+
+
+def _process_station(st: dict, day_str: str,
+                     pas_pool: Optional[ThreadPoolExecutor] = None,
+                     prefetch: Optional[Dict[int, Future]] = None) -> Tuple[Optional[list], Optional[int]]:
+    """
+    Traite une station pour le jour cible (exécuté dans un thread du pool).
+    Les pas sont tentés en parallèle via pas_pool (séquentiellement si None).
+    prefetch: préchargements /information-station en cours, attendus avant lecture du cache.
+    Retourne (ligne_csv, id_manquant): ligne à écrire sur stdout ou None,
+    id à inscrire au registre des manquants ou None.
+    """
+    sid_raw = st.get("id", "")
+    try:
+        sid = int(str(sid_raw).strip())
+    except Exception:
+        _log_line(station_id=sid_raw, etat="invalid_id", ok_data=False, reason="Identifiant station invalide")
+        return [sid_raw, ""] + [""] * len(UNION_COLS), None
+
+    scales = _scales_for_station(st)
+    if not scales:
+        avail = st.get("_scales")
+        if isinstance(avail, list) and avail:
+            # pas déclarés mais sans colonne neige: comme avant, aucune ligne et
+            # inscription au registre des manquants (pas de ligne à date vide)
+            _log_line(sid, "no_useful_scale", False, "Aucun pas utile (sans colonne neige)")
+            return None, sid
+        _log_line(sid, "no_scale", False, "Aucun pas actif pour cette station (STRICT)")
+        return [sid, ""] + [""] * len(UNION_COLS), None
+
+    fut = prefetch.get(sid) if prefetch else None
+    if fut is not None:
+        wait([fut])
+    activity = _station_activity_checked(sid, scales)
+
+    # Préfiltre: seuls les pas actifs le jour cible sont soumis au pool
+    active = []
+    for pas in scales:
+        if activity and not _pas_active_this_day(activity, pas, day_str):
+            _log_line(sid, f"{pas}:inactif", False, f"inactif le {day_str}")
+        else:
+            active.append(pas)
+
+    best_dt = None
+    best_row = None
+    best_pas = None
+
+    # Tente chaque pas autorisé, en parallèle si possible
+    done = threading.Event()
+    mapper = pas_pool.map if pas_pool is not None else map
+    results = [r for r in mapper(lambda pas: _try_pas(sid, pas, day_str, done), active) if r]
+
+    # Garde la mesure la plus récente (à égalité, le premier pas dans l'ordre PASSES)
+    if results:
+        best_dt, best_row, best_pas, best_cmd = max(results, key=lambda r: r[0])
+        _log_line(sid, "OK", True, f"pas={best_pas} cmd={best_cmd}")
+
+    # Harmonisation NEIGETOTX -> NEIGETOT pour la quotidienne
+    if best_pas == "quotidienne" and best_row:
+        if "NEIGETOT" not in best_row and "NEIGETOTX" in best_row:
+            best_row["NEIGETOT"] = best_row.pop("NEIGETOTX")
+        elif "NEIGETOTX" in best_row:
+            # si les deux existent on supprime l'alias
+            del best_row["NEIGETOTX"]
+
+    if not (best_dt and best_row):
+        # aucune mesure du tout
+        return None, sid
+
+    vals_map = _pick_values_case_insensitive(best_row, UNION_COLS)
+
+    # check si aucune valeur neige n’est renseignée
+    has_data = any(v not in ("", None) for v in vals_map.values())
+    if not has_data:
+        return None, sid
+
+    return [sid, best_dt.strftime("%Y-%m-%dT%H:%M:%SZ")] + [vals_map[c] for c in UNION_COLS], None
+
+
+def _csv_field(v) -> str:
+    """Champ CSV: guillemets seulement si nécessaire (comme csv.QUOTE_MINIMAL); None -> ""."""
+    s = "" if v is None else str(v)
+    if "," in s or '"' in s or "\n" in s or "\r" in s:
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+def _csv_line(fields: list) -> str:
+    return ",".join(map(_csv_field, fields)) + "\n"
+
+
+def _prefetch_activity(stations: List[dict], pool: ThreadPoolExecutor) -> Dict[int, Future]:
+    """
+    Lance en tâche de fond /information-station pour les stations ayant au moins un pas,
+    dans l'ordre du fichier. Non bloquant: retourne {sid: future}.
+    """
+    sids = []
+    for st in stations:
+        try:
+            sid = int(str(st.get("id", "")).strip())
+        except Exception:
+            continue
+        if _scales_for_station(st):
+            sids.append(sid)
+    return {sid: pool.submit(_station_activity, sid) for sid in sids}
+
+
 # --- CLI ------------------------------------------------------------------
 def main():
     ap = argparse.ArgumentParser(description="Fetch dernier enregistrement MF DPClim pour une date UTC")
@@ -375,11 +766,11 @@ def main():
     ap.add_argument("--stations", default=DEFAULT_STATIONS, help="Chemin du JSON stations combiné (_scales)")
     ap.add_argument("--id", type=int, help="Force une seule station ID précise")
     ap.add_argument("--logdir", default="logs/observations", help="Répertoire des logs horodatés")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS, help="Nombre de stations traitées en parallèle")
     args = ap.parse_args()
 
     # Init fichier log
-    global _LOG_PATH
-    _LOG_PATH = _init_log_file(args.logdir)
+    _init_log_file(args.logdir)
 
     # Valide la date
     try:
@@ -390,7 +781,8 @@ def main():
 
     # Charge les stations
     try:
-        stations = json.load(open(args.stations, "r", encoding="utf-8"))
+        with open(args.stations, "rb") as fh:
+            stations = json_io.loads(fh.read())
     except Exception as ex:
         sys.stderr.write(f"[io ] lecture stations échouée: {repr(ex)}\n")
         sys.exit(2)
@@ -402,98 +794,39 @@ def main():
         except ValueError:
             sys.stderr.write("[arg] --id doit être un entier\n")
             sys.exit(2)
-        stations = [st for st in stations if str(st.get("id","")).strip() == str(target_id)]
-        if not stations:
+        target_key = str(target_id)
+        match = next((st for st in stations if str(st.get("id", "")).strip() == target_key), None)
+        if match is None:
             sys.stderr.write(f"[id] {target_id} introuvable dans stations.json\n")
             sys.exit(1)
+        stations = [match]
 
     # Prépare CSV stdout: id,date,<UNION_COLS>
-    writer = csv.writer(sys.stdout, lineterminator="\n")
     header = ["id", "date"] + UNION_COLS
-    writer.writerow(header)
-
-    # Boucle stations
-    for st in stations:
-        sid_raw = st.get("id", "")
-        try:
-            sid = int(str(sid_raw).strip())
-        except Exception:
-            _log_line(station_id=sid_raw, etat="invalid_id", ok_data=False, reason="Identifiant station invalide")
-            writer.writerow([sid_raw, ""] + [""] * len(UNION_COLS))
-            continue
-
-        info = _info_station_cached(sid)
-        scales = _scales_for_station(st)
-        if not scales:
-            _log_line(sid, "no_scale", False, "Aucun pas actif pour cette station (STRICT)")
-            writer.writerow([sid, ""] + [""] * len(UNION_COLS))
-            continue
-
-        best_dt = None
-        best_row = None
-        best_pas = None
-
-        # Tente chaque pas autorisé
-        for pas in scales:
-            # Vérifie activité pour le jour cible
-            if info and not _pas_active_this_day(info, pas, args.date):
-                _log_line(sid, f"{pas}:inactif", False, f"inactif le {args.date}")
-                continue
-
-            # Fenêtre temporelle demandée
-            s_utc, e_utc = _day_window_utc(args.date, pas)
-
-            # Création de commande
-            ok, cmd_id, etat = commande_station(sid, pas, s_utc, e_utc)
-            if not ok:
-                _log_line(sid, f"{etat}", False, f"commande pas={pas} {s_utc}→{e_utc} échouée")
-                continue
-
-            # Téléchargement avec polling
-            sc, content = telecharger_commande(cmd_id, max_wait_s=300, step_s=5)
-            if sc not in (200, 201):
-                _log_line(sid, f"HTTP{sc}", False, f"pas={pas} cmd={cmd_id} fichier non prêt/erreur")
-                continue
-
-            # Parse et sélection de la dernière ligne datée
-            last_dt, row, _cols = parse_latest_row(content)
-            if not last_dt or not row:
-                _log_line(sid, "OK", False, f"pas={pas} cmd={cmd_id} aucune ligne datée valide")
-                continue
-
-            if last_dt.strftime("%Y-%m-%d") != args.date:
-                _log_line(sid, "OK", False, f"pas={pas} cmd={cmd_id} dernière mesure hors jour cible")
-                continue
-
-            # Mieux que l'actuel ?
-            if (best_dt is None) or (last_dt > best_dt):
-                best_dt, best_row, best_pas = last_dt, row, pas
-                _log_line(sid, "OK", True, f"pas={pas} cmd={cmd_id}")
-
-        # Harmonisation NEIGETOTX -> NEIGETOT pour la quotidienne
-        if best_pas == "quotidienne" and best_row:
-            if "NEIGETOT" not in best_row and "NEIGETOTX" in best_row:
-                best_row["NEIGETOT"] = best_row.pop("NEIGETOTX")
-            elif "NEIGETOTX" in best_row:
-                # si les deux existent on supprime l'alias
-                del best_row["NEIGETOTX"]
-
-        # Sortie CSV
-        if best_dt and best_row:
-            vals_map = _pick_values_case_insensitive(best_row, UNION_COLS)
-
-            # check si aucune valeur neige n’est renseignée
-            has_data = any(v not in ("", None) for v in vals_map.values())
-            if not has_data:
-                append_missing(sid, args.date)
-                continue
-
-            row_out = [sid, best_dt.strftime("%Y-%m-%dT%H:%M:%SZ")] + [vals_map[c] for c in UNION_COLS]
-            writer.writerow(row_out)
-        else:
-            # aucune mesure du tout
-            append_missing(sid, args.date)
-            continue
+    sys.stdout.write(_csv_line(header))
+    # Lignes formatées à la main, écrites par paquets (stdout non bufferisé en CI: PYTHONUNBUFFERED=1)
+    out_rows: List[str] = []
+
+    # Stations en parallèle; map() conserve l'ordre du fichier pour la sortie.
+    # Pool distinct pour les pas: un thread station attend ses pas sans bloquer le pool.
+    # Métadonnées stations (cache disque ou API) préchargées en parallèle, sans bloquer
+    # le démarrage: chaque station n'attend que la sienne.
+    workers = max(1, args.workers)
+    with ThreadPoolExecutor(max_workers=min(8, workers)) as info_pool, \
+            ThreadPoolExecutor(max_workers=workers * len(PASSES)) as pas_pool, \
+            ThreadPoolExecutor(max_workers=workers) as ex:
+        prefetch = _prefetch_activity(stations, info_pool)
+        for row_out, missing_sid in ex.map(lambda st: _process_station(st, args.date, pas_pool, prefetch), stations):
+            if row_out is not None:
+                out_rows.append(_csv_line(row_out))
+                if len(out_rows) >= OUT_FLUSH_ROWS:
+                    sys.stdout.write("".join(out_rows))
+                    out_rows.clear()
+            if missing_sid is not None:
+                append_missing(missing_sid, args.date)
+    sys.stdout.write("".join(out_rows))
+    # Replie le journal des manquants dans le JSON
+    compact_missing()
 
 
 if __name__ == "__main__":
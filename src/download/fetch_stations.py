@@ -5,16 +5,20 @@
 
 import argparse
 import os
-import json
 import time
+import threading
 import csv
 from pathlib import Path
 from typing import Dict, List, Union, Tuple
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ..api.token_provider import get_api_key, clear_token_cache
 from ..utils.combine_stations import main as combine_stations
+from ..utils import json_io
+from ..utils.rate_limiter import TokenBucket
 
 # Configuration
 BASE_URL = os.getenv("METEO_BASE_URL", "https://public-api.meteofrance.fr/public/DPClim/v1")
@@ -29,25 +33,11 @@ SCALES = {
 }
 MAX_RPM = int(os.getenv("METEO_MAX_RPM", "50"))
 RATE_PERIOD = 60.0
+RATE_BURST = int(os.getenv("METEO_BURST", "5"))
+MAX_WORKERS = int(os.getenv("METEO_STATIONS_WORKERS", "3"))
 
 # Rate limiter
-class RateLimiter:
-    def __init__(self, max_calls: int, period_sec: float):
-        self.max_calls = max_calls
-        self.period = period_sec
-        self.calls = deque()
-
-    def wait(self) -> None:
-        now = time.time()
-        while self.calls and (now - self.calls[0]) > self.period:
-            self.calls.popleft()
-        if len(self.calls) >= self.max_calls:
-            sleep_for = self.period - (now - self.calls[0]) + 0.01
-            if sleep_for > 0:
-                time.sleep(sleep_for)
-        self.calls.append(time.time())
-
-_rl = RateLimiter(MAX_RPM, RATE_PERIOD)
+_rl = TokenBucket(MAX_RPM / RATE_PERIOD, RATE_BURST)
 
 # Logging
 def _init_log_file() -> Path:
@@ -57,15 +47,21 @@ def _init_log_file() -> Path:
     return logdir / f"{ts}.log"
 
 _LOG_PATH = _init_log_file()
+_LOG_LOCK = threading.Lock()
 
 def _log(msg: str) -> None:
-    with _LOG_PATH.open("a", encoding="utf-8") as fh:
+    with _LOG_LOCK, _LOG_PATH.open("a", encoding="utf-8") as fh:
         fh.write(msg.rstrip() + "\n")
 
 # HTTP helpers
+# Session unique: keep-alive et pool de connexions, aucun retry implicite
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=0)))
+_SESSION.headers.update({"accept": "application/json", "User-Agent": "niveo/0.1.0"})
+
 def _headers_json() -> Dict[str, str]:
     token = get_api_key(use_cache=True)
-    return {"accept": "application/json", "authorization": f"Bearer {token}"}
+    return {"authorization": f"Bearer {token}"}
 
 # Annotate with scale
 def _annotate_with_scale(data, scale: str):
@@ -90,7 +86,7 @@ def fetch_stations_for_scale(department: int, scale: str) -> list:
     url = f"{BASE_URL}{SCALES[scale]}"
     params = {"id-departement": department}
     _rl.wait()
-    resp = requests.get(url, headers=_headers_json(), params=params, timeout=30)
+    resp = _SESSION.get(url, headers=_headers_json(), params=params, timeout=30)
 
     # Handle errors
     if resp.status_code == 204:
@@ -98,24 +94,22 @@ def fetch_stations_for_scale(department: int, scale: str) -> list:
     if resp.status_code in (401, 403):
         clear_token_cache()
         _rl.wait()
-        resp = requests.get(url, headers=_headers_json(), params=params, timeout=30)
+        resp = _SESSION.get(url, headers=_headers_json(), params=params, timeout=30)
         resp.raise_for_status()
     elif resp.status_code == 429:
         retry_after = resp.headers.get("Retry-After", "60")
         time.sleep(float(retry_after))
         _rl.wait()
-        resp = requests.get(url, headers=_headers_json(), params=params, timeout=30)
+        resp = _SESSION.get(url, headers=_headers_json(), params=params, timeout=30)
         resp.raise_for_status()
     else:
         resp.raise_for_status()
 
-    data = resp.json()
+    data = json_io.loads(resp.content)
     data = _annotate_with_scale(data, scale)
     out_dir = Path(SAVE_DIR) / scale
     out_dir.mkdir(parents=True, exist_ok=True)
-    (out_dir / f"stations_{department}.json").write_text(
-        json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8"
-    )
+    (out_dir / f"stations_{department}.json").write_bytes(json_io.dumps(data, indent=True))
     return data
 
 # Main orchestrator
@@ -124,10 +118,13 @@ def fetch_all_scales_all_departments(departments: List[int], scales: List[str]):
     counts = {s: {} for s in scales}
     conn_errors = 0
 
-    for s in scales:
-        for d in departments:
+    # Requêtes (pas, département) en parallèle; session et rate limiter partagés
+    with ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS)) as ex:
+        futures = {ex.submit(fetch_stations_for_scale, d, s): (s, d) for s in scales for d in departments}
+        for fut in as_completed(futures):
+            s, d = futures[fut]
             try:
-                data = fetch_stations_for_scale(d, s)
+                data = fut.result()
                 n = len(data) if isinstance(data, list) else 0
                 results[s][d] = data
                 counts[s][d] = n
@@ -142,12 +139,12 @@ def fetch_all_scales_all_departments(departments: List[int], scales: List[str]):
 # Print merged data as CSV
 def _print_merged_as_csv(path: Path) -> None:
     try:
-        data = json.loads(path.read_text(encoding="utf-8"))
+        data = json_io.loads(path.read_bytes())
     except Exception:
         data = []
 
-    sysout = os.sys.stdout
-    sysout.write("id,nom,lon,lat,alt,_scales\n")
+    # Lignes assemblées puis écrites en une fois
+    lines = ["id,nom,lon,lat,alt,_scales\n"]
 
     for st in (data or []):
         sid = st.get("id", "")
@@ -157,10 +154,10 @@ def _print_merged_as_csv(path: Path) -> None:
         alt = st.get("alt", "")
         scales = st.get("_scales", [])
 
-        scales_json = json.dumps(scales, ensure_ascii=False, separators=(",", ":"))
+        scales_json = json_io.dumps(scales).decode("utf-8")
         nom_safe = (str(nom) or "").replace(",", " ")
-        line = f"{sid},{nom_safe},{lon},{lat},{alt},{scales_json}\n"
-        sysout.write(line)
+        lines.append(f"{sid},{nom_safe},{lon},{lat},{alt},{scales_json}\n")
+    os.sys.stdout.write("".join(lines))
 
 # Main
 if __name__ == "__main__":
@@ -188,7 +185,7 @@ if __name__ == "__main__":
     fused_n = 0
     if fused_ok and COMBINED_PATH.exists():
         try:
-            fused = json.loads(COMBINED_PATH.read_text(encoding="utf-8"))
+            fused = json_io.loads(COMBINED_PATH.read_bytes())
             fused_n = len(fused) if isinstance(fused, list) else 0
         except Exception as e:
             _log(f"[combine] read_error: {e}")
@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 # Lit un CSV depuis STDIN et écrit en batch dans DynamoDB.
 # Ajout: --ttl-days pour expires_at. Ajout: --allow-empty pour accepter vide.
+# Ajout: --workers lots BatchWriteItem (25 items) envoyés en parallèle.
 
-import sys, csv, json, argparse
+import sys, re, csv, json, time, random, argparse, itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, timezone, timedelta
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+
+BATCH_SIZE = 25          # max BatchWriteItem
+MAX_UNPROCESSED_RETRIES = 8
+_SER = TypeSerializer()
+
+# Nombre décimal fini (entier, décimal, exposant): filtre avant Decimal, sans exception
+_NUM_RE = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
 
 def _to_decimal_or_str(v: str):
     s = v.strip()
     if s == "" or s.lower() == "nan":
         return None
+    if not _NUM_RE.fullmatch(s):
+        return s
     try:
         return Decimal(s)
     except InvalidOperation:
@@ -41,6 +54,7 @@ def _parse_date_utc(date_str: str) -> datetime | None:
     except Exception:
         return None
 
+@lru_cache(maxsize=1024)  # peu de dates distinctes par run: un parse par date
 def _compute_expires_at(date_str: str, days: int) -> int | None:
     d0 = _parse_date_utc(date_str)
     if d0 is None:
@@ -48,6 +62,54 @@ def _compute_expires_at(date_str: str, days: int) -> int | None:
     d_exp = d0 + timedelta(days=days, hours=23, minutes=59, seconds=59)
     return int(d_exp.timestamp())
 
+_BAD = object()  # PK illisible: ligne ignorée
+
+def _to_pk(v: str):
+    try:
+        return int(v.strip())  # PK en Number
+    except Exception:
+        return _BAD
+
+def _to_ttl(v: str):
+    try:
+        return int(v.strip())
+    except Exception:
+        return None
+
+def _to_scales(v: str):
+    return _parse_scales(v) or None
+
+def _column_converters(header: list, pk: str, sk: str | None, ttl_field: str) -> list:
+    """Un convertisseur par colonne, choisi une fois d'après l'en-tête (None = colonne ignorée)."""
+    convs = []
+    for k in header:
+        if k == "":
+            convs.append(None)
+        elif k == "_scales":
+            convs.append(_to_scales)
+        elif k == pk:
+            convs.append(_to_pk)
+        elif sk and k == sk:
+            convs.append(str.strip)      # SK en String
+        elif k == ttl_field:
+            convs.append(_to_ttl)
+        else:
+            convs.append(_to_decimal_or_str)
+    return convs
+
+def _batch_write(client, table: str, items: list) -> None:
+    """BatchWriteItem d'un lot; rejoue les UnprocessedItems avec backoff exponentiel + jitter."""
+    reqs = [{"PutRequest": {"Item": {k: _SER.serialize(v) for k, v in it.items()}}} for it in items]
+    delay = 0.05
+    for _ in range(MAX_UNPROCESSED_RETRIES):
+        resp = client.batch_write_item(RequestItems={table: reqs})
+        reqs = (resp.get("UnprocessedItems") or {}).get(table) or []
+        if not reqs:
+            return
+        time.sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, 5.0)
+    raise RuntimeError(f"{len(reqs)} items non traités après {MAX_UNPROCESSED_RETRIES} essais")
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--table", required=True)
@@ -59,6 +121,8 @@ def main():
                     help="nom d'attribut TTL (def=expires_at)")
     ap.add_argument("--allow-empty", action="store_true",
                     help="ne pas échouer si l'entrée est vide ou sans données")
+    ap.add_argument("--workers", type=int, default=8,
+                    help="lots BatchWriteItem envoyés en parallèle (def=8)")
     args = ap.parse_args()
 
     # Refuse absence de stdin sauf si --allow-empty
@@ -69,19 +133,21 @@ def main():
         print("ERROR: no stdin", file=sys.stderr)
         return 2
 
-    buf = sys.stdin.read()
+    # Lecture en flux: on ne consomme que jusqu'à la première ligne non vide
+    first = sys.stdin.readline()
+    while first and not first.strip():
+        first = sys.stdin.readline()
 
     # Vide total
-    if not buf.strip():
+    if not first:
         if args.allow_empty:
             print("NOOP: empty input", file=sys.stderr)
             return 0
         print("ERROR: 0 input lines", file=sys.stderr)
         return 3
 
-    data_lines = buf.splitlines()
-    reader = csv.DictReader(data_lines)
-    header = reader.fieldnames or []
+    reader = csv.reader(itertools.chain([first], sys.stdin))
+    header = next(reader, None) or []
 
     # Pas d'en-tête
     if not header:
@@ -99,59 +165,88 @@ def main():
         print(f"ERROR: missing header or keys. header={header}", file=sys.stderr)
         return 4
 
-    ddb = boto3.resource("dynamodb")
-    table = ddb.Table(args.table)
+    # Client bas niveau: thread-safe, partagé par les workers
+    client = boto3.client("dynamodb")
 
     pkeys = [args.pk] + ([args.sk] if args.sk else [])
+    convs = _column_converters(header, args.pk, args.sk, args.ttl_field)
+    use_ttl = args.ttl_days > 0
+    date_key = args.sk or "date"
     wrote = 0
     skipped = 0
 
+    # Lot courant dédupliqué sur les clés (comme overwrite_by_pkeys: le dernier gagne).
+    # Une clé encore en vol dans un lot précédent attend ce lot avant de repartir,
+    # pour que l'ordre d'écriture reste celui de l'entrée.
+    chunk = {}
+    deps = set()
+    sent = {}      # clé -> lot en vol qui l'écrit
+    pending = {}   # lot en vol -> ses clés
+    workers = max(1, args.workers)
+    max_inflight = 2 * workers
+
+    def reap(done) -> None:
+        """Retire les lots terminés (et leurs clés); la première erreur arrête l'envoi."""
+        for fut in done:
+            for key in pending.pop(fut):
+                if sent.get(key) is fut:
+                    del sent[key]
+            fut.result()
+
     # Écrire. Si aucune ligne de données, NOOP si autorisé.
-    with table.batch_writer(overwrite_by_pkeys=pkeys) as bw:
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        def flush():
+            if deps:
+                wait(deps)
+                deps.clear()
+            fut = ex.submit(_batch_write, client, args.table, list(chunk.values()))
+            keys = list(chunk)
+            for key in keys:
+                sent[key] = fut
+            pending[fut] = keys
+            chunk.clear()
+            reap([f for f in pending if f.done()])
+            # contre-pression: mémoire bornée par max_inflight lots
+            if len(pending) >= max_inflight:
+                reap(wait(pending, return_when=FIRST_COMPLETED).done)
+
         for row in reader:
+            if not row:
+                continue
             item = {}
-            for k, v in row.items():
-                if k == "" or v is None:
+            for k, conv, v in zip(header, convs, row):
+                if conv is None:
                     continue
-                if k == "_scales":
-                    lst = _parse_scales(v)
-                    if lst:
-                        item[k] = lst
-                    continue
-                if k == args.pk:
-                    try:
-                        item[k] = int(v.strip())  # PK en Number
-                    except Exception:
-                        item = None
-                        break
-                    continue
-                if args.sk and k == args.sk:
-                    item[k] = v.strip()          # SK en String
-                    continue
-                if k == args.ttl_field:
-                    try:
-                        item[k] = int(str(v).strip())
-                    except Exception:
-                        pass
-                    continue
-                val = _to_decimal_or_str(v)
+                val = conv(v)
                 if val is None:
                     continue
+                if val is _BAD:
+                    item = None
+                    break
                 item[k] = val
 
             if not item or args.pk not in item or (args.sk and args.sk not in item):
                 skipped += 1
                 continue
 
-            if args.ttl_days > 0 and args.ttl_field not in item:
-                date_col = item.get(args.sk) if args.sk else item.get("date")
+            if use_ttl and args.ttl_field not in item:
+                date_col = item.get(date_key)
                 if isinstance(date_col, str):
                     exp = _compute_expires_at(date_col, args.ttl_days)
                     if exp is not None:
                         item[args.ttl_field] = exp  # int → Number
 
-            bw.put_item(Item=item)
+            key = tuple(item[k] for k in pkeys)
+            if key in sent:
+                deps.add(sent[key])
+            chunk[key] = item
             wrote += 1
+            if len(chunk) >= BATCH_SIZE:
+                flush()
+
+        if chunk:
+            flush()
+        reap(wait(pending).done)
 
     if wrote == 0 and skipped == 0 and args.allow_empty:
         print("NOOP: header only", file=sys.stderr)
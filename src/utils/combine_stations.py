@@ -2,12 +2,16 @@
 # Script: combine all stations JSON (different scales/depts) into one deduplicated file.
 
 import os
+import sys
 import argparse
-import json
 import re
 import math
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from src.utils import json_io
+
 SRC_DIR = Path("data/metadonnees/download/stations")
 OUT_DIR = Path("data/metadonnees")
 OUT_FILE = OUT_DIR / "stations.json"
@@ -16,14 +20,22 @@ ID_KEY = "id"
 NAME_KEY = "nom"
 KEEP_KEYS = ("lon", "lat", "alt")
 SCALE_KEY = "_scales"
-_VALID_SCALES = {"infrahoraire-6m", "horaire", "quotidienne"}
+# en dessous, le démarrage des processus coûte plus que le parsing
+PARALLEL_MIN_FILES = int(os.getenv("COMBINE_PARALLEL_MIN_FILES", "32"))
+_VALID_SCALES = frozenset({"infrahoraire-6m", "horaire", "quotidienne"})
+# ordre de sortie de _scales: celui de sorted(), fixé une fois pour toutes
+_SCALE_ORDER = tuple(sorted(_VALID_SCALES))
+
+def _ordered_scales(s: set) -> list:
+    """Pas présents dans s, dans l'ordre de _SCALE_ORDER (s ne contient que des pas valides)."""
+    return [x for x in _SCALE_ORDER if x in s]
 
 def _extract_scales(item: dict) -> set:
     """Retourne un set des pas valides à partir de _scales ou _scale."""
     out = set()
     v = item.get("_scales")
     if isinstance(v, list):
-        out.update(s for s in v if s in _VALID_SCALES)
+        out.update([s for s in v if s in _VALID_SCALES])
     v = item.get("_scale")
     if isinstance(v, str) and v in _VALID_SCALES:
         out.add(v)
@@ -45,39 +57,47 @@ def normalize_name(raw: str) -> str:
     s = _RE_SPACES.sub(" ", s).strip()
     return s.lower()
 
-_PARTICLES = {
+_PARTICLES = frozenset({
     "de", "du", "des", "la", "le", "les", "et", "à", "au", "aux", "sur",
     "sous", "par", "en", "chez", "l", "d"
-}
+})
 
 def _cap_first(s: str) -> str:
     if not s:
         return s
     return s[0].upper() + s[1:].lower()
 
+# mots séparés par espace ou tiret; le split capturant garde les séparateurs
+_RE_WORD_SEP = re.compile(r"([ -])")
+
+def _cap_word(h: str, is_first: bool) -> str:
+    """Capitalise un mot sauf particule (hors premier mot); "d'x" -> particule + "'" + X."""
+    if "'" in h:
+        pre, post = h.split("'", 1)
+        pre_fmt = _cap_first(pre) if is_first or pre not in _PARTICLES else pre
+        return f"{pre_fmt}'{_cap_first(post)}"
+    return _cap_first(h) if is_first or h not in _PARTICLES else h
+
 def capitalize_name(normalized: str) -> str:
     if not normalized:
         return normalized
-    parts = normalized.split(" ")
-    out_parts = []
-    for i, part in enumerate(parts):
-        is_first = (i == 0)
-        hy_parts = part.split("-")
-        out_hy = []
-        for j, h in enumerate(hy_parts):
-            if "'" in h:
-                pre, post = h.split("'", 1)
-                pre_fmt = _cap_first(pre) if is_first or pre not in _PARTICLES else pre
-                post_fmt = _cap_first(post)
-                out_hy.append(f"{pre_fmt}'{post_fmt}")
-            else:
-                if is_first or h not in _PARTICLES:
-                    out_hy.append(_cap_first(h))
-                else:
-                    out_hy.append(h)
-            is_first = False
-        out_parts.append("-".join(out_hy))
-    return " ".join(out_parts)
+    # un seul découpage: [mot, sep, mot, sep, ...], mots aux indices pairs
+    toks = _RE_WORD_SEP.split(normalized)
+    toks[0] = _cap_word(toks[0], True)
+    for i in range(2, len(toks), 2):
+        toks[i] = _cap_word(toks[i], False)
+    return "".join(toks)
+
+class _AltTable(dict):
+    """Table str.translate: garde chiffres (tout Unicode, comme \\d), point et signe,
+    virgule -> point, supprime le reste (espaces fines, 'm', ...). Mémoïse par caractère."""
+    def __missing__(self, code: int):
+        c = chr(code)
+        out = "." if c == "," else (code if c.isdecimal() or c in ".-" else None)
+        self[code] = out
+        return out
+
+_ALT_TABLE = _AltTable()
 
 def _coerce_alt_to_int(v):
     """Convertit l'altitude en int ou None.
@@ -93,13 +113,11 @@ def _coerce_alt_to_int(v):
             return None
         return int(round(v))
     if isinstance(v, str):
-        s = v.strip().lower()
-        # retire 'm' et espaces fines, points, etc.
-        s = s.replace("m", "")
-        # uniformise virgules en points
-        s = s.replace(",", ".")
-        # supprime tout sauf chiffres, signe et point
-        s = re.sub(r"[^\d\.\-]", "", s)
+        # cas courant: entier déjà propre
+        if v.isdecimal():
+            return int(v)
+        # virgule -> point, supprime tout sauf chiffres, signe et point (dont 'm', espaces fines)
+        s = v.translate(_ALT_TABLE)
         if not s:
             return None
         try:
@@ -124,76 +142,137 @@ def pick_better(existing: dict, candidate: dict) -> dict:
     existing[SCALE_KEY].update(candidate[SCALE_KEY])
     return existing
 
+def _kept(entry: dict, alt_select: int) -> bool:
+    """Faux si la station ne peut plus passer le filtre final, quels que soient
+    les fichiers suivants: posteOuvert est celui du premier vu, alt n'est
+    remplie que si vide."""
+    if not entry.get("posteOuvert", False):
+        return False
+    alt = entry.get("alt")
+    return alt is None or alt >= alt_select
+
+# champs projetés depuis les enregistrements bruts (le reste n'est jamais lu)
+_COPY_KEYS = ("lon", "lat")
+_ABSENT = object()
+
+def _entries_from_records(arr: list) -> list:
+    """Convertit en lot les enregistrements bruts d'un fichier en entrées normalisées.
+    Ignore les enregistrements sans id. Le nom reste brut: il n'est normalisé
+    que pour les stations retenues (cf. main).
+    """
+    entries = []
+    append = entries.append
+    intern = sys.intern
+    for item in arr:
+        sid = str(item.get(ID_KEY, "")).strip()
+        if not sid:
+            continue
+        # même id dans chaque fichier de pas: une seule chaîne partagée, comparaisons par identité
+        sid = intern(sid)
+        entry = {"id": sid, "nom": item.get(NAME_KEY) or ""}
+        # Copie des champs clés: une seule recherche par clé
+        get = item.get
+        for k in _COPY_KEYS:
+            v = get(k, _ABSENT)
+            if v is not _ABSENT:
+                entry[k] = v
+        v = get("alt", _ABSENT)
+        if v is not _ABSENT:
+            entry["alt"] = _coerce_alt_to_int(v)
+        # Ajoute posteOuvert si présent
+        v = get("posteOuvert", _ABSENT)
+        if v is not _ABSENT:
+            entry["posteOuvert"] = v
+        # Initialise _scales
+        entry[SCALE_KEY] = _extract_scales(item)
+        append(entry)
+    return entries
+
+def _parse_one_file(fp: Path) -> tuple[list | None, str | None]:
+    """Lit et convertit un fichier (exécutable dans un processus fils).
+    Retourne (entrées, None) ou (None, message d'erreur)."""
+    try:
+        arr = json_io.loads(fp.read_bytes())
+    except Exception as e:
+        return None, f"Skipping {fp} (read error): {e}"
+    if not isinstance(arr, list):
+        return None, f"Skipping {fp} (not a list)"
+    return _entries_from_records(arr), None
+
+def _id_sort_key(e: dict) -> tuple:
+    """Ids numériques dans l'ordre des entiers, les autres (rares) ensuite, en texte."""
+    sid = e["id"]
+    return (0, int(sid), "") if sid.isdecimal() else (1, 0, sid)
+
 def main(alt_select: int) -> None:
-    files = list(SRC_DIR.glob("**/stations_*.json"))
-    if not files:
+    # parcours paresseux: seuls les PARALLEL_MIN_FILES premiers chemins sont lus
+    # d'avance (choix série/parallèle), le reste alimente le pool au fil de l'eau
+    files_iter = SRC_DIR.glob("**/stations_*.json")
+    head = list(islice(files_iter, PARALLEL_MIN_FILES))
+    if not head:
         print(f"No input files found under {SRC_DIR}")
         return
 
     by_id: dict[str, dict] = {}
-    for fp in files:
-        try:
-            arr = json.loads(fp.read_text(encoding="utf-8"))
-        except Exception as e:
-            print(f"Skipping {fp} (read error): {e}")
-            continue
-        if not isinstance(arr, list):
-            print(f"Skipping {fp} (not a list)")
-            continue
 
-        for item in arr:
-            sid = str(item.get(ID_KEY, "")).strip()
-            if not sid:
+    def _merge(results) -> None:
+        # map() garde l'ordre des fichiers: fusion "premier vu" inchangée
+        for entries, err in results:
+            if err:
+                print(err)
                 continue
-            raw_name = item.get(NAME_KEY) or ""
-            name = normalize_name(raw_name)
-            entry = {"id": sid, "nom": name}
-            # Copie des champs clés
-            if "lon" in item:
-                entry["lon"] = item["lon"]
-            if "lat" in item:
-                entry["lat"] = item["lat"]
-            if "alt" in item:
-                entry["alt"] = _coerce_alt_to_int(item["alt"])
-            # Ajoute posteOuvert si présent
-            if "posteOuvert" in item:
-                entry["posteOuvert"] = item["posteOuvert"]
-            # Initialise _scales
-            entry[SCALE_KEY] = _extract_scales(item)
-            if sid in by_id:
-                by_id[sid] = pick_better(by_id[sid], entry)
-            else:
-                by_id[sid] = entry
-
-    # post-traitement et filtrage
-    out_list = [by_id[k] for k in sorted(by_id.keys())]
-    for e in out_list:
-        e["nom"] = capitalize_name(e.get("nom", ""))
-
-        # normalise altitude une dernière fois et garde un int ou None
-        e["alt"] = _coerce_alt_to_int(e.get("alt"))
+            get = by_id.get
+            for entry in entries:
+                sid = entry["id"]
+                existing = get(sid)
+                if existing is None:
+                    by_id[sid] = entry
+                elif _kept(existing, alt_select):
+                    pick_better(existing, entry)
+                # sinon: posteOuvert (premier vu) faux ou alt (remplie, figée) trop basse,
+                # la station est déjà exclue, inutile de fusionner
+
+    # parsing des fichiers en parallèle (processus), fusion dans le parent
+    if len(head) >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            _merge(ex.map(_parse_one_file, chain(head, files_iter), chunksize=4))
+    else:
+        _merge(_parse_one_file(fp) for fp in head)
+
+    # filtrage avant post-traitement: noms normalisés pour les seules stations retenues
+    filtered = []
+    for e in by_id.values():
+        # alt déjà int ou None (convertie au parsing, pick_better ne copie que ces valeurs);
+        # clé posée si absente, comme à l'écriture
+        alt_val = e.setdefault("alt", None)
+        poste_ouvert = e.get("posteOuvert", False)  # Par défaut False si absent
+        if alt_val is not None and alt_val >= alt_select and poste_ouvert:
+            filtered.append(e)
+    # tri numérique des ids (comme missing_registry), sur les seules stations retenues
+    filtered.sort(key=_id_sort_key)
+
+    name_cache: dict[str, str] = {}
+    for e in filtered:
+        raw_name = e.get("nom", "")
+        name = name_cache.get(raw_name)
+        if name is None:
+            name = name_cache[raw_name] = capitalize_name(normalize_name(raw_name))
+        e["nom"] = name
 
         # convertit set -> liste ordonnée pour _scales
         sc = e.get(SCALE_KEY, set())
         if isinstance(sc, set):
-            e[SCALE_KEY] = sorted(sc)
+            e[SCALE_KEY] = _ordered_scales(sc)
         # nettoie toute trace de _scale unitaire si présent
         if "_scale" in e:
             del e["_scale"]
 
-    filtered = []
-    for e in out_list:
-        alt_val = e.get("alt")  # déjà int ou None
-        poste_ouvert = e.get("posteOuvert", False)  # Par défaut False si absent
-        if alt_val is not None and alt_val >= alt_select and poste_ouvert:
-            filtered.append(e)
-
     # --- supprimer la colonne 'posteOuvert' avant écriture ---
     for e in filtered:
         e.pop("posteOuvert", None)
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
-    OUT_FILE.write_text(json.dumps(filtered, ensure_ascii=False, indent=2), encoding="utf-8")
+    OUT_FILE.write_bytes(json_io.dumps(filtered, indent=True))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -1,47 +1,87 @@
 #!/usr/bin/env python3
 # Enregistre les (id, date) non récupérés dans un JSON, sans doublons.
-# Écriture atomique pour éviter la corruption.
+# append_missing ajoute une ligne à un journal NDJSON (O(1) par appel);
+# compact() replie le journal dans le JSON (écriture atomique) et le supprime.
 
 import os
-import json
 import tempfile
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+
+from src.utils import json_io
 
 DEFAULT_PATH = Path(os.getenv("MISSING_OBS_JSON", "data/metadonnees/missing_observations.json"))
 
+# fsync avant rename/après append. SNOWVIZ_FSYNC=0: écritures toujours atomiques (pas de
+# fichier tronqué) mais sans garantie de survie à une coupure de courant.
+_FSYNC = os.getenv("SNOWVIZ_FSYNC", "1") == "1"
+
+# Registre groupé déjà parsé, par chemin, invalidé par st_mtime_ns
+_CACHE: Dict[Path, Tuple[int, Dict[str, Dict[str, Any]]]] = {}
+# (id, date) déjà enregistrés (JSON + journal), par chemin, même invalidation
+_SEEN: Dict[Path, Tuple[int, set]] = {}
+
 def _ensure_parent(p: Path) -> None:
     p.parent.mkdir(parents=True, exist_ok=True)
 
+def _journal_path(path: Path) -> Path:
+    return path.with_suffix(".ndjson")
+
+def _read_journal(journal: Path) -> List[Dict[str, Any]]:
+    """Lignes {"id", "date"} du journal; ligne tronquée (arrêt brutal) ignorée."""
+    out = []
+    for line in journal.read_bytes().splitlines():
+        try:
+            out.append(json_io.loads(line))
+        except Exception:
+            continue
+    return out
+
 def _read_any(path: Path) -> Any:
     if not path.exists():
         return []
     try:
-        with path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        return json_io.loads(path.read_bytes())
     except Exception:
         return []
 
 def _atomic_write(path: Path, payload: Any) -> None:
     _ensure_parent(path)
-    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", dir=str(path.parent)) as tmp:
-        json.dump(payload, tmp, ensure_ascii=False, indent=2)
-        tmp.flush()
-        os.fsync(tmp.fileno())
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=str(path.parent)) as tmp:
+        tmp.write(json_io.dumps(payload, indent=True))
+        if _FSYNC:
+            tmp.flush()
+            os.fsync(tmp.fileno())
         tmp_name = tmp.name
     os.replace(tmp_name, path)
 
+def _mtime_ns(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+def _load_grouped(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Registre groupé, relu seulement si le fichier a changé depuis la dernière lecture/écriture."""
+    mtime = _mtime_ns(path)
+    hit = _CACHE.get(path)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    grouped = _to_grouped(_read_any(path))
+    _CACHE[path] = (mtime, grouped)
+    return grouped
+
 def _to_grouped(data: Any) -> Dict[str, Dict[str, Any]]:
-    grouped = {}
+    # dédup des dates par set (O(1) par insertion), tri une seule fois à la fin
+    ids: Dict[str, int] = {}
+    date_sets: Dict[str, set] = defaultdict(set)
 
     def _ins(_id: int, _date: Optional[str]) -> None:
         key = str(int(_id))
-        slot = grouped.get(key)
-        if slot is None:
-            slot = {"id": int(_id), "dates": []}
-            grouped[key] = slot
-        if _date and _date not in slot["dates"]:
-            slot["dates"].append(_date)
+        ids.setdefault(key, int(_id))
+        if _date:
+            date_sets[key].add(_date)
 
     if isinstance(data, list):
         for item in data:
@@ -61,29 +101,56 @@ def _to_grouped(data: Any) -> Dict[str, Dict[str, Any]]:
             elif "date" in item:
                 _ins(item.get("id", k), str(item["date"]))
 
-    for slot in grouped.values():
-        slot["dates"].sort()
-
-    return grouped
+    return {k: {"id": i, "dates": sorted(date_sets[k])} for k, i in ids.items()}
 
 def _grouped_to_list(grouped: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
     out = list(grouped.values())
     out.sort(key=lambda x: int(x["id"]))
     return out
 
-def append_missing(station_id: int, date_str: str, *, path: Path = DEFAULT_PATH) -> None:
-    raw = _read_any(path)
-    grouped = _to_grouped(raw)
+def _seen_for(path: Path) -> set:
+    """Couples (id, date) connus, construits au premier appel depuis le JSON et le journal."""
+    mtime = _mtime_ns(path)
+    hit = _SEEN.get(path)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    seen = {(slot["id"], d) for slot in _load_grouped(path).values() for d in slot["dates"]}
+    journal = _journal_path(path)
+    if journal.exists():
+        for e in _read_journal(journal):
+            try:
+                seen.add((int(e["id"]), str(e["date"])))
+            except Exception:
+                continue
+    _SEEN[path] = (mtime, seen)
+    return seen
 
-    key = str(int(station_id))
-    slot = grouped.get(key)
-    if slot is None:
-        slot = {"id": int(station_id), "dates": []}
-        grouped[key] = slot
-
-    if date_str not in slot["dates"]:
-        slot["dates"].append(date_str)
-        slot["dates"].sort()
-
-    payload = _grouped_to_list(grouped)
-    _atomic_write(path, payload)
\ No newline at end of file
+def append_missing(station_id: int, date_str: str, *, path: Path = DEFAULT_PATH) -> None:
+    """Ajoute (id, date) au journal; dédupliqué et trié au compact()."""
+    seen = _seen_for(path)
+    t = (int(station_id), date_str)
+    if t in seen:
+        return
+    journal = _journal_path(path)
+    _ensure_parent(journal)
+    line = json_io.dumps({"id": int(station_id), "date": date_str}) + b"\n"
+    with journal.open("ab") as f:
+        f.write(line)
+        if _FSYNC:
+            f.flush()
+            os.fsync(f.fileno())
+    seen.add(t)
+
+def compact(*, path: Path = DEFAULT_PATH) -> None:
+    """Replie le journal dans le JSON groupé {id, dates:[...]} puis supprime le journal."""
+    journal = _journal_path(path)
+    if not journal.exists():
+        return
+    grouped = _load_grouped(path)
+    _CACHE.pop(path, None)  # modifié sur place: invalide tant que l'écriture n'a pas abouti
+    for key, slot in _to_grouped(_read_journal(journal)).items():
+        cur = grouped.setdefault(key, {"id": slot["id"], "dates": []})
+        cur["dates"] = sorted(set(cur["dates"]).union(slot["dates"]))
+    _atomic_write(path, _grouped_to_list(grouped))
+    _CACHE[path] = (_mtime_ns(path), grouped)
+    journal.unlink()
\ No newline at end of file
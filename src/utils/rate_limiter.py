@@ -0,0 +1,32 @@
+# src/utils/rate_limiter.py
+# Limiteur de débit partagé par les scripts de téléchargement (horloge monotone, thread-safe).
+
+import time
+import random
+import threading
+
+
+class TokenBucket:
+    """
+    Seau à jetons: débit régulier de 'rate' appels/s, rafale bornée à 'burst'.
+    Lisse les appels (pas de rafale de max_calls en début de fenêtre) pour éviter les 429.
+    Partagé entre threads.
+    """
+
+    def __init__(self, rate: float, burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate + random.uniform(0.01, 0.05))